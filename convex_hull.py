@@ -1,117 +1,198 @@
-from pybresenham import line as bline
-
-
-def isContour(obj, x, y):
-    """
-    Returns whether a given pixel is a contour of an object using a 4-connected space.
-
-    :param obj: object the pixel comes from.
-    :param x: x coordinate of the pixel.
-    :param y: y coordinate of the pixel.
-    :return: True if pixel(x,y) is a contour of the object, False otherwise.
-    """
-    if x < 0 or y < 0 or x >= len(obj) or y >= len(obj[0]) or not (obj[x][y]):  # not part of the object -> not a contour.
-        return False
-    if x == 0 or y == 0 or x == len(obj) - 1 or y == len(obj) - 1:  # is along the border of image so it's an object's contour.
-        return True
-    # if a pixel in a 4-connected space is void, it means the original pixel is a contour of the object.
-    return not (obj[x - 1][y]) or not (obj[x + 1][y]) or not (obj[x][y - 1]) or not (obj[x][y + 1])
+import numpy as np
+from numba import njit
+from scipy.ndimage import binary_erosion
+from scipy.spatial import cKDTree
 
 
 def object_contour(obj):
     """
-    Goes through all pixels of the image of the object and returns a list of all pixels considered as contour in a
-    4-connected space.
+    Returns a list of all pixels of the object considered as contour in a 4-connected space. A pixel is a contour if
+    it is part of the object and at least one of its 4 neighbors is void (pixels outside the image are void).
 
     :param obj: object image to detect contours of.
     :return: list of tuples(x,y) with x and y = coordinates of each pixel.
     """
-    cont = []
-    for i in range(len(obj)):
-        for j in range(len(obj)):
-            if isContour(obj, i, j):
-                cont.append((i, j))
-    return cont
-
-
-def get_corner_pixel(contour):
-    """
-    Find the pixel that is going to act as the pivot point of the convex hull computation.
-
-    :param contour: list of points considered as contours of the image.
-    :return: tuple(x,y), the point minimal x value or y value if multiple points have the same x min value.
-    """
-    min_pix = (9999, 9999)
-    for pixel in contour:
-        if pixel[0] < min_pix[0] or (pixel[0] == min_pix[0] and pixel[1] < min_pix[1]):
-            min_pix = pixel
-    return min_pix
-
-
-def compute_slope(p1, p2):
-    """
-    Compute the slope of a vector defined by its 2 ends. If the x value of both points are equals, return 1 to avoid
-    division by zero.
-
-    :param p1: first end of the vector.
-    :param p2: second end of the vector.
-    :return: slope of the vector.
-    """
-    if p2[0] - p1[0] == 0:
-        return 1
-    return (p2[1] - p1[1]) / (p2[0] - p1[0])
+    arr = np.asarray(obj, dtype=bool)
+    # the default structuring element is 4-connected, and pixels outside of the image are void (border_value=0).
+    contour = arr & ~binary_erosion(arr)
+    return list(map(tuple, np.argwhere(contour).tolist()))
 
 
+@njit(cache=True)
 def compute_power(line_p1, line_p2, point):
     """
     Compute the power of a vector to a point.
     :param line_p1: first endpoint of the vector.
     :param line_p2: second endpoint of the vector.
     :param point: point used to compare the vector to.
-    :return: float value, either negative or positive (>0 -> left side of the vector, <0 -> right side of the vector).
+    :return: integer value, either negative or positive (>0 -> left side of the vector, <0 -> right side of the vector).
     """
     dy = line_p2[1] - line_p1[1]
     dx = line_p2[0] - line_p1[0]
     return int(dy * (point[0] - line_p1[0]) - dx * (point[1] - line_p1[1]))
 
 
-def sortby_slope(minpix, contour):
+def akl_filter(points):
     """
-    Create a copy and sort the list of contour points according to the slope of each point compared to the starting
-    point of the convex hull computation.
-    :param minpix: starting point of the convex hull computation (min(x), min(y)).
-    :param contour: list of the points considered as a contour.
-    :return:sorted list.
+    Akl-Toussaint heuristic: discard the points lying inside the octagon formed by the extreme points of the set along
+    x, y, x+y and x-y. Those points cannot be part of the convex hull, so removing them shortens the hull computation.
+
+    :param points: list of points considered as a contour.
+    :return: list of tuples(x,y), the extreme points and the points outside of the octagon.
     """
-    sorted_contour = sorted(contour, key=lambda s: compute_slope(minpix, s))
-    return sorted_contour
+    pts = np.asarray(points, dtype=np.int32)  # pixel coordinates, the products of the power fit in 32 bits.
+    x = pts[:, 0]
+    y = pts[:, 1]
+    # extreme points in counter-clockwise order, so that inner points are on the left side of every edge.
+    extremes = [y.argmin(), (x - y).argmax(), x.argmax(), (x + y).argmax(),
+                y.argmax(), (x - y).argmin(), x.argmin(), (x + y).argmin()]
+    a = pts[extremes][:, None, :]
+    b = np.roll(pts[extremes], -1, axis=0)[:, None, :]
+    # power of each of the 8 edges of the octagon to every point at once, array of shape (8, number of points).
+    power = (b[..., 0] - a[..., 0]) * (y - a[..., 1]) - (b[..., 1] - a[..., 1]) * (x - a[..., 0])
+    inside = np.logical_and.reduce(power >= 0, axis=0)
+    inside[extremes] = False
+    return list(map(tuple, pts[~inside].tolist()))
 
 
 def convex_hull(obj):
     """
-    compute the convex hull of an object using Graham's algorithm.
+    compute the convex hull of an object using Andrew's monotone chain algorithm.
 
-    1) find the pivot point (x min, or y min).
-    2) compute slopes of line of pivot point to all other points of the object.
-    3) sort points by their slope (with the pivot point).
-    4) remove incrementally concave angles using the power of a segment to a point.
+    1) discard the contour points that cannot be part of the hull (see akl_filter), then sort the remaining points
+    lexicographically (x min, then y min).
+    2) build the lower hull, popping the last point while it does not make a strict turn with the next point.
+    3) build the upper hull the same way on the reversed points.
+    4) concatenate both hulls, dropping the duplicated endpoints.
 
     :param obj: object to compute the convex hull of.
     :return: point used as starting point, list of points from the convex hull.
     """
-    contour = object_contour(obj)
-    min_pix = get_corner_pixel(contour)
-    sorted_contour = sortby_slope(min_pix, contour)
-    ch = sorted_contour
-    i = 1
-    while i < len(ch) - 1:
-        power = compute_power(ch[i - 1], ch[i + 1], ch[i])
-        if power >= 0:
-            i += 1
+    points = sorted(set(akl_filter(object_contour(obj))))
+    if len(points) < 3:
+        return points[0], points
+    ch = _monotone_chain(np.array(points, dtype=np.int64))
+    return tuple(ch[0].tolist()), list(map(tuple, ch.tolist()))
+
+
+@njit(cache=True, fastmath=True)
+def _monotone_chain(points):
+    """
+    Compute the convex hull of sorted points: the lower hull then the upper hull are built in the same buffer used as a
+    stack.
+
+    :param points: array of shape (n, 2) of unique points sorted lexicographically, with n >= 3.
+    :return: array of the points of the convex hull, starting from the first point.
+    """
+    hull = np.empty((2 * len(points), 2), dtype=np.int64)
+    k = 0
+    for i in range(len(points)):
+        while k >= 2 and compute_power(hull[k - 2], hull[k - 1], points[i]) >= 0:
+            k -= 1
+        hull[k] = points[i]
+        k += 1
+    lower_size = k
+    for i in range(len(points) - 2, -1, -1):
+        while k > lower_size and compute_power(hull[k - 2], hull[k - 1], points[i]) >= 0:
+            k -= 1
+        hull[k] = points[i]
+        k += 1
+    return hull[:k - 1]
+
+
+def bline(x1, y1, x2, y2):
+    """
+    Compute the points of the line between (x1, y1) and (x2, y2) using Bresenham's algorithm.
+
+    :param x1: x value of the first end.
+    :param y1: y value of the first end.
+    :param x2: x value of the second end.
+    :param y2: y value of the second end.
+    :return: iterator over the tuples(x,y) of the line, from the first end to the second one.
+    """
+    out = np.empty((max(abs(x2 - x1), abs(y2 - y1)) + 1, 2), dtype=np.int64)
+    return map(tuple, bresenham_into(int(x1), int(y1), int(x2), int(y2), out).tolist())
+
+
+@njit(cache=True)
+def bresenham_into(x1, y1, x2, y2, out):
+    """
+    Write the Bresenham points of the line between (x1, y1) and (x2, y2) into a preallocated buffer. The error term is
+    handled as in pybresenham.line: ties are broken differently when the line is drawn backwards.
+
+    :param x1: x value of the first end.
+    :param y1: y value of the first end.
+    :param x2: x value of the second end.
+    :param y2: y value of the second end.
+    :param out: array of shape (at least max(|x2 - x1|, |y2 - y1|) + 1, 2) to write the points into.
+    :return: view of out containing the points of the line.
+    """
+    steep = abs(y2 - y1) > abs(x2 - x1)
+    if steep:  # work along the major axis.
+        x1, y1 = y1, x1
+        x2, y2 = y2, x2
+    reverse = x1 > x2
+    if reverse:  # the line is drawn from the second end (after swapping the ends).
+        x1, x2 = x2, x1
+        y1, y2 = y2, y1
+    dx = x2 - x1
+    dy = abs(y2 - y1)
+    error = dx // 2
+    ystep = 1 if y1 < y2 else -1
+    y = y2 if reverse else y1
+    for i in range(dx + 1):
+        x = x2 - i if reverse else x1 + i
+        if steep:
+            out[i, 0] = y
+            out[i, 1] = x
         else:
-            ch.pop(i)
-            i -= 1
-    return min_pix, ch
+            out[i, 0] = x
+            out[i, 1] = y
+        error -= dy
+        if reverse and error <= 0:
+            y -= ystep
+            error += dx
+        elif not reverse and error < 0:
+            y += ystep
+            error += dx
+    return out[:dx + 1]
+
+
+def bresenham_batch(x1, y1, x2, y2):
+    """
+    Compute the Bresenham points of several lines at once. Each line gives the same points, in the same order, as
+    bline(x1, y1, x2, y2). Scalar ends are broadcast, which is useful for half-lines sharing their first end.
+
+    :param x1: x values of the first ends of the lines.
+    :param y1: y values of the first ends of the lines.
+    :param x2: x values of the second ends of the lines.
+    :param y2: y values of the second ends of the lines.
+    :return: array of shape (number of lines, max length, 2) of the points of each line, shorter lines being padded with
+    their last point ; array of the length of each line.
+    """
+    x1, y1, x2, y2 = (np.atleast_1d(v).astype(int) for v in np.broadcast_arrays(x1, y1, x2, y2))
+    # work along the major axis, from the smallest major coordinate (see bresenham_into).
+    steep = np.abs(y2 - y1) > np.abs(x2 - x1)
+    a1, b1 = np.where(steep, y1, x1), np.where(steep, x1, y1)
+    a2, b2 = np.where(steep, y2, x2), np.where(steep, x2, y2)
+    rev = a1 > a2
+    a1, a2 = np.where(rev, a2, a1), np.where(rev, a1, a2)
+    b1, b2 = np.where(rev, b2, b1), np.where(rev, b1, b2)
+    dx = (a2 - a1)[:, None]
+    dy = np.abs(b2 - b1)[:, None]
+    error = dx // 2
+    b_step = np.where(b1 < b2, 1, -1)[:, None]
+    lengths = dx[:, 0] + 1
+    k = np.minimum(np.arange(lengths.max())[None, :], dx)
+    # number of steps taken on the minor axis after k steps on the major axis, in closed form.
+    m_forward = -((error - k * dy) // np.maximum(dx, 1))
+    m_reversed = np.minimum((k * dy - error) // np.maximum(dx, 1) + 1, k)
+    rev = rev[:, None]
+    major = np.where(rev, a2[:, None] - k, a1[:, None] + k)
+    minor = np.where(rev, b2[:, None] - b_step * m_reversed, b1[:, None] + b_step * m_forward)
+    steep = steep[:, None]
+    points = np.stack([np.where(steep, minor, major), np.where(steep, major, minor)], axis=-1)
+    return points, lengths
 
 
 def compute_polygon(min_pix, ch):
@@ -121,13 +202,11 @@ def compute_polygon(min_pix, ch):
     :param ch: list of points acting as the convex hull.
     :return: list of bresenham points to draw.
     """
-    points = list(bline(min_pix[0], min_pix[1], ch[0][0], ch[0][1]))
-    for i in range(len(ch) - 1):
-        x1 = ch[i]
-        x2 = ch[i + 1]
-        points.extend(list(bline(x1[0], x1[1], x2[0], x2[1])))
-    points.extend(list(bline(ch[-1][0], ch[-1][1], min_pix[0], min_pix[1])))
-    return points
+    starts = np.array([min_pix] + ch)
+    ends = np.array(ch + [min_pix])
+    points, lengths = bresenham_batch(starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1])
+    valid = np.arange(points.shape[1]) < lengths[:, None]
+    return list(map(tuple, points[valid].tolist()))
 
 
 def get_closest_convex_hull_points(points1, points2):
@@ -137,31 +216,25 @@ def get_closest_convex_hull_points(points1, points2):
 
     :param points1: list of points from the first convex hull.
     :param points2: list of points from the second convex hull.
-    :return: middle point of the shortest line.
+    :return: both ends of the shortest line (using the manhattan distance).
     """
-    min1 = 0
-    min2 = 0
-    dist = 9999
-    for p1 in points1:
-        for p2 in points2:
-            if manhattan(p1[0], p1[1], p2[0], p2[1]) < dist:
-                dist = manhattan(p1[0], p1[1], p2[0], p2[1])
-                min1 = p1
-                min2 = p2
-    return min1, min2
+    points1 = np.asarray(points1)
+    points2 = np.asarray(points2)
+    dist, closest = cKDTree(points2).query(points1, p=1)
+    i = dist.argmin()
+    return tuple(points1[i].tolist()), tuple(points2[closest[i]].tolist())
 
 
-def connected8_check(x, y, obj_list):
+def connected8_check(x, y, obj_set):
     """
     Checks if, for a given x and y values, a point is in an 8-connected space.
 
     :param x: x value of the point.
     :param y: y value of the point.
-    :param obj_list: list of points to check, is mainly used to compare intersection with a convex hull.
-    :return: True if (x,y) are coordinates of, or a neighbor of a point in the list.
+    :param obj_set: set of points to check, is mainly used to compare intersection with a convex hull.
+    :return: True if (x,y) are coordinates of, or a neighbor of a point in the set.
     """
-    matrix = [(x + 1, y + 1), (x + 1, y), (x + 1, y - 1), (x, y - 1), (x, y), (x, y - 1), (x - 1, y + 1), (x - 1, y), (x - 1, y - 1)]
-    return any(pt in obj_list for pt in matrix)
+    return any((x + dx, y + dy) in obj_set for dx in (-1, 0, 1) for dy in (-1, 0, 1))
 
 
 def manhattan(x1, y1, x2, y2):
@@ -1,37 +1,59 @@
+import hashlib
 import json
 import math
+import os
 
 import numpy as np
+from joblib import Parallel, delayed
+from numba import njit
 from PIL import Image
 from convex_hull import *
 
 
-def image_segmentation(imagename: str, backgroundcolor):
+SEGMENTATION_CACHE_VERSION = 2  # to increment whenever the masks returned by image_segmentation change.
+
+
+def image_segmentation(imagename: str, backgroundcolor, cache_dir=None):
     """
     Segment images such as SimpleShapes images where the background color is removed, and masks of objects of the same
-    colors are obtained.
+    colors are obtained. Masks can be cached in a folder (keyed by the image, its modification time, the background
+    color and SEGMENTATION_CACHE_VERSION), so an image is only segmented once across runs.
 
     :param imagename: name of the image to mask.
     :param backgroundcolor: Color of the background to remove.
+    :param cache_dir: folder where masks are cached, None to disable the cache.
     :return: list of binary images (mask of object 1, mask of object 2).
     """
+    if cache_dir is not None:
+        key = (f"{SEGMENTATION_CACHE_VERSION}-{os.path.abspath(imagename)}-{os.path.getmtime(imagename)}-"
+               f"{tuple(backgroundcolor)}")
+        cache_file = f"{cache_dir}/{hashlib.md5(key.encode()).hexdigest()}.npz"
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as masks:
+                return [masks[f"arr_{n}"] for n in range(len(masks.files))]
     filepath = imagename.split("/")
     filename = filepath[-1]
     path = '/'.join(filepath[:-1])
     im = Image.open(f"{path}/{filename}")
     im = im.convert('RGBA')
     data = np.array(im)
-    colors = set(tuple(clr) for p in data for clr in p)
-    colors.remove(backgroundcolor)
+    colors, first_pixel = np.unique(data.reshape(-1, 4), axis=0, return_index=True)
+    # compatibility with the original code, which iterated over a set of colors filled pixel by pixel: the order of the
+    # objects (hence RLM1/RLM2 and the direction of forces) is that set's iteration order. Inserting the same colors in
+    # the same first-appearance order makes CPython build an identical hash table, and so iterate in the same order.
+    # Sets do not guarantee any order: do not replace this with the sorted np.unique order, it would swap the objects.
+    colors = set(map(tuple, colors[np.argsort(first_pixel)].tolist()))
+    colors.remove(tuple(backgroundcolor))
     objects = []
-    for n, c in enumerate(colors):
-        data_copy = data.copy()
-        R, G, B, A = data.T
-        non_colored_area = (R != c[0]) & (G != c[1]) & (B != c[2])
-        data_copy[..., :-1][non_colored_area.T] = (0, 0, 0)
-        colored_area = ~non_colored_area
-        data_copy[..., :-1][colored_area.T] = (255, 255, 255)
-        objects.append(colored_area)
+    for c in colors:
+        colored_area = (data[..., :3] == np.array(c[:3])).all(axis=-1)
+        objects.append(colored_area.T)  # masks are indexed as [x][y].
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"  # images may be segmented by several processes at once.
+        with open(tmp_file, "wb") as f:
+            np.savez_compressed(f, *objects)
+        os.replace(tmp_file, cache_file)
     return objects
 
 
@@ -46,12 +68,7 @@ def center_point(objects):
     hulls = []
     for obj in objects:
         min_pix, c_hull = convex_hull(obj)
-        hull = []
-        size_c_hull = len(c_hull)
-        for p in range(size_c_hull):
-            hull.extend(list(
-                bline(c_hull[p][0], c_hull[p][1], c_hull[(p + 1) % size_c_hull][0], c_hull[(p + 1) % size_c_hull][1])))
-        hulls.append(hull)
+        hulls.append(set(compute_polygon(min_pix, c_hull)))
     pt1 = barycentre(objects[0])
     pt2 = barycentre(objects[1])
     lin = list(bline(pt1[0], pt1[1], pt2[0], pt2[1]))
@@ -75,25 +92,23 @@ def center_point(objects):
     return int((fp1[0] + fp2[0]) / 2), int((fp1[1] + fp2[1]) / 2)
 
 
-def lines_diameters(objects, x, y, step):
+def radial_line_ends(objects, x, y, step):
     """
-    Returns a list of lines and diameters from which to compute forces and the radial line mode.
+    Returns the ends of the diameters from which half-lines and diameters are drawn.
 
     :param objects: objects to compute data from.
     :param x: x coordinate of the middle points.
     :param y: y coordinate of the middle points.
     :param step: step of the angle.
-    :return: (List of z half-lines, List of z/2 diameters)
+    :return: x and y values of the first ends (also the ends of the half-lines), x and y values of the opposite ends.
     """
     radius = radial_line_model_radius(objects, x, y)
-    lines = []
-    diameters = []
-    for i in range(int(math.pi * 2 / step)):
-        point = round(x + radius * math.cos(step * -i)), round(y + radius * math.sin(step * -i))
-        point_2 = round(x + radius * math.cos(step * -i + math.pi)), round(y + radius * math.sin(step * -i + math.pi))
-        lines.append(list(bline(x, y, point[0], point[1])))
-        diameters.append(list(bline(point[0], point[1], point_2[0], point_2[1])))
-    return lines, diameters
+    angles = step * -np.arange(int(math.pi * 2 / step))
+    ex = np.round(x + radius * np.cos(angles)).astype(int)
+    ey = np.round(y + radius * np.sin(angles)).astype(int)
+    ex2 = np.round(x + radius * np.cos(angles + math.pi)).astype(int)
+    ey2 = np.round(y + radius * np.sin(angles + math.pi)).astype(int)
+    return ex, ey, ex2, ey2
 
 
 def barycentre(obj):
@@ -103,127 +118,188 @@ def barycentre(obj):
     :param obj: object to compute the barycentre from : usually 2D binary list.
     :return:x and y coordinates.
     """
-    x_pixels = [x for x in range(len(obj)) for y in range(len(obj[x])) if obj[x][y]]
-    y_pixels = [y for x in range(len(obj)) for y in range(len(obj[x])) if obj[x][y]]
-    return int(sum(x_pixels) / len(x_pixels)), int(sum(y_pixels) / len(y_pixels))
+    x_pixels, y_pixels = np.nonzero(np.asarray(obj))
+    return int(x_pixels.mean()), int(y_pixels.mean())
 
 
 def radial_line_model_radius(objects, x, y):
     """
-    Compute the minimum radius of the RLM needed to cover the two objects to compute Spatial Relations from.
+    Compute the minimum radius of the RLM needed to cover the two objects to compute Spatial Relations from. Bounding
+    boxes are computed over both axes of the masks, which may be non-square.
 
     :param objects: list of two 2D binary list. (binary masks of both of the objects).
     :param x: x coordinates of the middle point.
     :param y: y coordinates of the middle point.
     :return: Integer: maximum length between the middle point and the farthest point of any object.
     """
-    bounding_boxes = []
+    corners = []
     for obj in objects:
-        maxX = maxY = 0
-        minX = minY = len(obj)
-        for i, listJ in enumerate(obj):
-            for j, value in enumerate(listJ):
-                if value:
-                    minX = i if i < minX else minX
-                    minY = j if j < minY else minY
-                    maxX = i if i > maxX else maxX
-                    maxY = j if j > maxY else maxY
-        bounding_boxes.append([minX, maxX, minY, maxY])
-    x_max = 0
-    y_max = 0
-    o = 0
-    for bb in bounding_boxes:
-        for x1 in range(2):
-            for y1 in range(2):
-                if manhattan(x, y, bb[x1], bb[y1 + 2]) > o:
-                    o = manhattan(x, y, bb[x1], bb[y1 + 2])
-                    x_max = bb[x1]
-                    y_max = bb[y1 + 2]
-    return int(math.dist((x, y), (x_max, y_max)))
-
-
-def forces(objects, diameters, force_type):
-    """
-    Compute forces between the objects.
+        x_pixels, y_pixels = np.nonzero(np.asarray(obj))
+        minX, maxX = x_pixels.min(), x_pixels.max()
+        minY, maxY = y_pixels.min(), y_pixels.max()
+        corners.extend([(minX, minY), (minX, maxY), (maxX, minY), (maxX, maxY)])
+    corners = np.array(corners)
+    dx = corners[:, 0] - x
+    dy = corners[:, 1] - y
+    farthest = (np.abs(dx) + np.abs(dy)).argmax()  # farthest corner of the bounding boxes using manhattan distance.
+    return int(np.hypot(dx[farthest], dy[farthest]))
+
+
+def extended_rlm(objects, x, y, step, force_type):
+    """
+    Compute the RLM of both objects and the forces histogram in a single pass: half-lines and diameters are drawn
+    together and the masks of the objects are read only once for all of their pixels.
 
     :param objects: list of two 2D binary list. (binary masks of both of the objects).
-    :param diameters: list of diameters from the middle point to compute forces from.
+    :param x: x coordinate of the middle point.
+    :param y: y coordinate of the middle point.
+    :param step: step of the angle.
+    :param force_type: type of force, usually f=0 or f=2 is used.
+    :return: 3 histograms of the same size: RLM1, RLM2, F-histogram.
+    """
+    lines, lines_length, diameters, diameters_length = lines_diameters(objects, x, y, step)
+    rlm1, rlm2 = rlm_histograms(points_labels(lines, objects), lines_length)
+    force = forces_histogram(points_labels(diameters, objects), diameters, diameters_length, force_type)
+    return rlm1, rlm2, force
+
+
+def lines_diameters(objects, x, y, step):
+    """
+    Returns the lines and diameters from which to compute forces and the radial line model. Half-lines and diameters
+    are drawn together in a single array of shape (2z, max length, 2), shorter lines being padded with their last
+    point ; the points of a line are the first ones up to its length.
+
+    :param objects: objects to compute data from.
+    :param x: x coordinate of the middle points.
+    :param y: y coordinate of the middle points.
+    :param step: step of the angle.
+    :return: (array of z half-lines, array of their lengths, array of z diameters, array of their lengths)
+    """
+    ex, ey, ex2, ey2 = radial_line_ends(objects, x, y, step)
+    n = len(ex)
+    points, lengths = bresenham_batch(np.concatenate([np.full(n, x), ex]), np.concatenate([np.full(n, y), ey]),
+                                      np.concatenate([ex, ex2]), np.concatenate([ey, ey2]))
+    return points[:n], lengths[:n], points[n:], lengths[n:]
+
+
+def forces_histogram(labels, points, lengths, force_type):
+    """
+    Compute forces between the objects from the labels of the pixels of the diameters.
+
+    :param labels: array of shape (number of diameters, max length) of labels (see points_labels).
+    :param points: array of shape (number of diameters, max length, 2) of the pixels of the diameters.
+    :param lengths: array of the length of each diameter.
     :param force_type: type of force, usually f=0 or f=2 is used.
     :return: force computed from each diameter in a list. Can be constructed as a histogram.
     """
-    travels = []
-    for line in diameters:
-        line_travel = []
-        for pt in line:
-            if 0 <= pt[0] < len(objects[1]) and 0 <= pt[1] < len(objects[1][0]) and objects[1][pt[0]][pt[1]]:
-                line_travel.append("A")
-            elif 0 <= pt[0] < len(objects[0]) and 0 <= pt[1] < len(objects[0][0]) and objects[0][pt[0]][pt[1]]:
-                line_travel.append("B")
-            else:
-                line_travel.append("_")
-        travels.append(line_travel)
-    forces = []
-    for i, fline in enumerate(travels):
-        force = 0
-        if 'A' in fline and 'B' in fline:
-            for p in range(len(fline)):
-                if fline[p] == 'A':
-                    for r in range(p, len(fline)):
-                        if fline[r] == 'B':
-                            if force_type == 0:
-                                force += int(math.dist((diameters[i][p][0], diameters[i][p][1]), (diameters[i][r][0], diameters[i][r][1])))
-                            else:
-                                dist = int(math.dist((diameters[i][p][0], diameters[i][p][1]), (diameters[i][r][0], diameters[i][r][1])))
-                                force += math.log(pow(dist + 1, 2) / (dist * (dist + 2)))
-        forces.append(force)
+    forces = _force_lines(labels, points, lengths, force_type)
+    if force_type == 0:
+        return forces.astype(int).tolist()
+    return forces.tolist()
+
+
+@njit(cache=True)
+def _force_lines(labels, points, lengths, force_type):
+    """
+    Compute the force along each diameter, from every pixel of the second object (A) to every pixel of the first object
+    only (B) found after it.
+
+    :param labels: array of shape (number of diameters, max length) of labels (see points_labels).
+    :param points: array of shape (number of diameters, max length, 2) of the pixels of the diameters.
+    :param lengths: array of the length of each diameter.
+    :param force_type: type of force, usually f=0 or f=2 is used.
+    :return: array of the force computed on each diameter.
+    """
+    forces = np.zeros(len(lengths))
+    for i in range(len(lengths)):
+        for p in range(lengths[i]):
+            if labels[i, p] & 2:
+                for r in range(p + 1, lengths[i]):
+                    if labels[i, r] == 1:
+                        dx = points[i, r, 0] - points[i, p, 0]
+                        dy = points[i, r, 1] - points[i, p, 1]
+                        dist = int(np.sqrt(dx * dx + dy * dy))
+                        if force_type == 0:
+                            forces[i] += dist
+                        else:
+                            forces[i] += np.log((dist + 1) ** 2 / (dist * (dist + 2)))
     return forces
 
 
-def radial_line_model(lines, objects):
+def rlm_histograms(labels, lengths):
     """
-    Compute the Radial Line Model data  from the objects on the lines.
+    Compute the Radial Line Model data from the labels of the pixels of the half-lines.
 
-    :param lines: half-lines from the middle point.
+    :param labels: array of shape (number of half-lines, max length) of labels (see points_labels).
+    :param lengths: array of the length of each half-line.
+    :return: list of the size of the number of half-lines for each object.
+    """
+    valid = np.arange(labels.shape[1]) < lengths[:, None]  # lines shorter than the longest one are padded.
+    histObj1 = ((labels & 1).astype(bool) & valid).sum(axis=1) / lengths
+    histObj2 = ((labels & 2).astype(bool) & valid).sum(axis=1) / lengths
+    return histObj1.tolist(), histObj2.tolist()
+
+
+def points_labels(points, objects):
+    """
+    Label points according to the objects they are overlapping on.
+
+    :param points: array of shape (..., 2) of (x,y) points.
     :param objects: list of two 2D binary list. (binary masks of both of the objects).
-    :return: list of the size of the number of half-lines.
+    :return: uint8 array of shape (...), bit 1 set on the first object, bit 2 set on the second object.
     """
-    histObj1 = []
-    histObj2 = []
-    for line in lines:
-        length = len(line)
-        histObj1.append(len([p for p in line if point_overlap(p, objects[0])]) / length)
-        histObj2.append(len([p for p in line if point_overlap(p, objects[1])]) / length)
-    return histObj1, histObj2
+    labels = points_overlap(points, objects[0]).astype(np.uint8)
+    labels |= points_overlap(points, objects[1]).astype(np.uint8) << 1
+    return labels
 
 
-def point_overlap(pt, obj):
+def points_overlap(points, obj):
     """
-    Return a Boolean that determines whether a point is overlapping on an object.
+    Return which points of an array are overlapping on an object.
 
-    :param pt: pt -> (x,y)
-    :param obj: 2D list (list of lists) of boolean values.
-    :return: True if (x,y) of pt is True in the list of the obj.
+    :param points: array of shape (..., 2) of (x,y) points.
+    :param obj: 2D list (list of lists) or array of boolean values.
+    :return: boolean array of shape (...), True where (x,y) of the point is True in the obj.
     """
-    if 0 <= pt[0] < len(obj) and 0 <= pt[1] < len(obj[0]):
-        return obj[pt[0]][pt[1]]
-    return False
+    obj = np.asarray(obj, dtype=bool)
+    x = points[..., 0]
+    y = points[..., 1]
+    inside = (0 <= x) & (x < obj.shape[0]) & (0 <= y) & (y < obj.shape[1])
+    overlap = np.zeros(x.shape, dtype=bool)
+    overlap[inside] = obj[x[inside], y[inside]]
+    return overlap
 
 
-def image_processing(imagename, background, step, force_type):
+def image_processing(imagename, background, step, force_type, cache_dir=None):
     """
     Compute from an image, the RLM of the first and the second object and forces histogram.
     :param imagename: name of the file of the image.
     :param background: background color of the image.
     :param step: step of the angle needed to compute half-lines and diameters for the RLM and F-histogram.
     :param force_type: type of force to use for the computation (usually 0 or 2).
+    :param cache_dir: folder where segmentation masks are cached, None to disable the cache.
     :return: 3 histograms of the same size: RLM1, RLM2, F-histogram.
     """
-    objects = image_segmentation(imagename, background)
+    objects = image_segmentation(imagename, background, cache_dir)
     x, y = center_point(objects)
-    lines, diameters = lines_diameters(objects, x, y, step * math.pi / 180)
-    rlm1, rlm2 = radial_line_model(lines, objects)
-    force = forces(objects, diameters, force_type)
-    return rlm1, rlm2, force
+    return extended_rlm(objects, x, y, step * math.pi / 180, force_type)
+
+
+def bbox_processing(sub, obj, size_x, size_y, step, force_type):
+    """
+    Compute from the bounding boxes of a SpatialSense relation, the RLM of the subject and the object and forces
+    histogram.
+    :param sub: annotated subject of the relation.
+    :param obj: annotated object of the relation.
+    :param size_x: width of the image.
+    :param size_y: height of the image.
+    :param step: step of the angle needed to compute half-lines and diameters. In Radian.
+    :param force_type: type of force to use for the computation (usually 0 or 2).
+    :return: 3 histograms of the same size: RLM1, RLM2, F-histogram.
+    """
+    objs = [bbox_mask(sub, size_x, size_y), bbox_mask(obj, size_x, size_y)]
+    x, y = center_point(objs)
+    return extended_rlm(objs, x, y, step, force_type)
 
 
 def SpatialSense_learning(folder, annots, step_deg, force_type):
@@ -236,11 +312,8 @@ def SpatialSense_learning(folder, annots, step_deg, force_type):
     :param force_type: type of force to use.
     :return: list of all Histograms of step_deg*3 (RLM1, RLM2, F-Histogram) value, list of predicates of the images.
     """
-    data = []
-    number = 0
-    forces_data = []
-    relation = []
     step_rad = step_deg * math.pi / 180
+    relations = []
     for ant in annots:
         if 'flickr' in ant["url"]:
             path = folder + "flickr/"
@@ -248,41 +321,46 @@ def SpatialSense_learning(folder, annots, step_deg, force_type):
             path = folder + "nyu/"
         if '/' in path:
             path += ant["url"].split("/")[-1]
-        size_x = ant["width"]
-        size_y = ant["height"]
         for rel in ant["annotations"]:
             predicate = rel["predicate"]
             if rel["label"] and predicate in ["to the left of", "to the right of", "above", "under"]:
                 # print(rel)
-                sub = rel["subject"]
-                obj = rel["object"]
-                obj_img = [[bbox_value(obj, x, y) for y in range(size_x)] for x in range(size_y)]
-                sub_img = [[bbox_value(sub, x, y) for y in range(size_x)] for x in range(size_y)]
-                objs = [sub_img, obj_img]
-                x, y = center_point(objs)
-                lines, diameters = lines_diameters(objs, x, y, step_rad)
-                rlm1, rlm2 = radial_line_model(lines, objs)
-                force = forces(objs, diameters, force_type)
-                data.append({
-                    'filename':path,
-                    "rel": predicate,
-                    "sub": sub["name"],
-                    "obj": obj["name"],
-                    'forces': force + rlm1 + rlm2
-                })
-                number += 1
-                forces_data.append(force + rlm1 + rlm2)
-                relation.append(predicate)
+                relations.append((path, predicate, rel["subject"], rel["object"], ant["width"], ant["height"]))
+    # relations are independent from each other, so they are processed in parallel.
+    results = Parallel(n_jobs=-1)(
+        delayed(bbox_processing)(sub, obj, size_x, size_y, step_rad, force_type)
+        for _, _, sub, obj, size_x, size_y in relations)
+    data = []
+    number = 0
+    forces_data = []
+    relation = []
+    for (path, predicate, sub, obj, _, _), (rlm1, rlm2, force) in zip(relations, results):
+        data.append({
+            'filename':path,
+            "rel": predicate,
+            "sub": sub["name"],
+            "obj": obj["name"],
+            'forces': force + rlm1 + rlm2
+        })
+        number += 1
+        forces_data.append(force + rlm1 + rlm2)
+        relation.append(predicate)
     print(number)
     with open("output/SpatialSense_data.json", "w") as f:
         json.dump(data, f, indent=2)
-    return forces, relation
+    return forces_data, relation
 
 
-def bbox_value(obj, x, y):
-    bbox = obj["bbox"]
-    x_min = bbox[0]
-    x_max = bbox[1]
-    y_min = bbox[2]
-    y_max = bbox[3]
-    return y_min <= y <= y_max and x_min <= x <= x_max
\ No newline at end of file
+def bbox_mask(obj, size_x, size_y):
+    """
+    Return the binary mask of the bounding box of a SpatialSense object.
+
+    :param obj: annotated object, its "bbox" field is (x min, x max, y min, y max) with x the row of the image.
+    :param size_x: width of the image.
+    :param size_y: height of the image.
+    :return: 2D binary array of shape (size_y, size_x), True inside the bounding box.
+    """
+    x_min, x_max, y_min, y_max = obj["bbox"]
+    mask = np.zeros((size_y, size_x), dtype=bool)
+    mask[x_min:x_max + 1, y_min:y_max + 1] = True
+    return mask
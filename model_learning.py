@@ -1,8 +1,11 @@
 import csv
 import glob
 
-from sklearn.model_selection import train_test_split, cross_val_score
+from joblib import Parallel, delayed
+from sklearn.model_selection import train_test_split, cross_validate
 from sklearn.neural_network import MLPClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
 
 from image import image_processing
 
@@ -15,16 +18,24 @@ def train_model(X=None, Y=None, print_scores=False):
     :param print_scores: boolean, used to allow or not the printing of accuracy found during training.
     :return: the trained model.
     """
-    X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2) # 0.2
-    clf = MLPClassifier(hidden_layer_sizes=(4, 448), solver='adam', max_iter=1000)  # 224
-    clf.fit(X_train, Y_train)
+    # RLM values are in [0, 1] while forces can be huge: features are standardized before the MLP.
+    clf = Pipeline([
+        ('sc', StandardScaler()),
+        ('mlp', MLPClassifier(hidden_layer_sizes=(4, 448), solver='adam', max_iter=1000,  # 224
+                              early_stopping=True, n_iter_no_change=10)),
+    ])
     if print_scores:
-        scores = cross_val_score(clf, X, Y, cv=5)
+        # each model of the cross validation is trained on 80% of the data, the first one is kept.
+        cv = cross_validate(clf, X, Y, cv=5, return_estimator=True)
+        scores = cv["test_score"]
         print("%0.2f accuracy with a standard deviation of %0.2f" % (scores.mean(), scores.std()))
+        return cv["estimator"][0]
+    X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2) # 0.2
+    clf.fit(X_train, Y_train)
     return clf
 
 
-def compute_extendedRLM_on_SimpleShape(folder, annotations, background, step, force):
+def compute_extendedRLM_on_SimpleShape(folder, annotations, background, step, force, cache_dir=None):
     """
     Compute the histograms (RLMs and forces) of all images of the SimpleShape dataset (either S1 or S2).
 
@@ -33,17 +44,17 @@ def compute_extendedRLM_on_SimpleShape(folder, annotations, background, step, fo
     :param background: Background color of the images.
     :param step: Step of the angle to use for the computation of the histograms.
     :param force: type of force to use (0, or 2) for the computation of the f-histogram.
+    :param cache_dir: folder where segmentation masks are cached, None to disable the cache.
     :return: Two lists: (Histograms and classes).
     """
-    X_data = []
-    Y_data = []
-    for row in annotations:
-        print(f"img-{row['obj1']}-{row['obj2']}-{row['nb']}.png")
-        if row['nb'] != "?":
-            img_name = f"{folder}/img-{row['obj1']}-{row['obj2']}-{row['nb']}.png"
-            rlm1, rlm2, forces = image_processing(img_name, background, step, force)
-            X_data.append(rlm1 + rlm2 + forces)
-            Y_data.append(row["rel"])
+    rows = [row for row in annotations if row['nb'] != "?"]
+    # images are independent from each other, so they are processed in parallel.
+    results = Parallel(n_jobs=-1)(
+        delayed(image_processing)(f"{folder}/img-{row['obj1']}-{row['obj2']}-{row['nb']}.png", background, step, force,
+                                  cache_dir)
+        for row in rows)
+    X_data = [rlm1 + rlm2 + forces for rlm1, rlm2, forces in results]
+    Y_data = [row["rel"] for row in rows]
     return X_data, Y_data
 
 